@@ -7,14 +7,26 @@ You need to configure your username/password and possibly Highway SSL client cer
 import os
 import re
 import sys
+import json
 import time
+import random
 import logging
 import datetime
+import threading
+import functools
+import itertools
+import collections
+import concurrent.futures
 from typing import List
 from configparser import BasicInterpolation
 
 # python3 -m pip install jira
 import jira
+# python3 -m pip install jira2markdown
+from jira2markdown import convert as convert_to_md
+# installed as dependencies of jira
+import requests
+import urllib3
 
 #######################################################################
 # ConfigParser functionality extension
@@ -23,9 +35,82 @@ class EnvInterpolation(BasicInterpolation):
     """Interpolation which expands environment variables in values."""
     #https://stackoverflow.com/questions/26586801/configparser-and-string-interpolation-with-env-variable
     def before_get(self, parser, section, option, value, defaults):
+        if "$" not in value and "%" not in value:
+            # nothing to interpolate
+            return value
         value = super().before_get(parser, section, option, value, defaults)
         return os.path.expandvars(value)
 
+#######################################################################
+# Caching functionality
+#######################################################################
+class LRUCache(collections.OrderedDict):
+    """Thread-safe dictionary which holds at most max_size entries, evicting the least recently used ones."""
+    def __init__(self, *args, max_size:int=10000, **kwargs):
+        self.max_size = max_size
+        self._lock = threading.RLock()
+        super().__init__(*args, **kwargs)
+
+    def __getitem__(self, key):
+        with self._lock:
+            value = super().__getitem__(key)
+            self.move_to_end(key)
+            return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            super().__setitem__(key, value)
+            self.move_to_end(key)
+            if self.max_size and len(self) > self.max_size:
+                self.popitem(last=False)
+
+# cache entry of a user which was not found in Jira at time ts (epoch)
+UserNotFound = collections.namedtuple("UserNotFound", ["ts"])
+
+def load_user_cache(path:str, server:str, max_size:int=10000, not_found_ttl_s:int=7*24*3600, logger:logging.Logger=None) -> LRUCache:
+    """ loads the user references cached for the given server from a JSON file. A missing or unreadable file provides an empty cache.
+    Users not found in Jira are stored as {"neg": true, "ts": epoch}: they are discarded after not_found_ttl_s seconds, to be checked again"""
+    if not logger:
+        logger = logging.getLogger("usercache")
+    cache = LRUCache(max_size=max_size)
+    if not os.path.isfile(path):
+        return cache
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            entries = json.load(f).get(server, {})
+        now = time.time()
+        for username, entry in entries.items():
+            if entry is None:
+                continue
+            if entry.get("neg"):
+                if now - entry.get("ts", 0) < not_found_ttl_s:
+                    cache[username] = UserNotFound(entry["ts"])
+            else:
+                cache[username] = entry
+        logger.info(f'Loaded {len(cache)} cached users for "{server}" from "{path}"')
+    except (OSError, ValueError, AttributeError) as e:
+        logger.warning(f'Unable to load user cache file "{path}", starting with an empty cache: {e}')
+    return cache
+
+def save_user_cache(path:str, server:str, cache:dict, logger:logging.Logger=None):
+    """ stores the user references cached for the given server into a JSON file, keeping the entries of other servers"""
+    if not logger:
+        logger = logging.getLogger("usercache")
+    data = {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        pass
+    data[server] = {username: {"neg": True, "ts": entry.ts} if isinstance(entry, UserNotFound) else entry for username, entry in cache.items() if entry is not None}
+    try:
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(f"{path}.tmp", path)
+        logger.info(f'Saved {len(cache)} cached users for "{server}" to "{path}"')
+    except OSError as e:
+        logger.warning(f'Unable to save user cache file "{path}": {e}')
+
 #######################################################################
 # JIRA-related functions
 #######################################################################
@@ -37,16 +122,42 @@ class JiraRelatedError(Exception):
     def __str__(self):
         return self.message
 
+_TS_MSEC_RE = re.compile(r"\.\d{3}")
+
+# timestamps repeat a lot across comments (e.g. the creation time of the issue), hence parsing results are cached
+@functools.lru_cache(maxsize=1 << 15)
 def jira_timestamp_to_dt(ts:str) -> datetime.datetime:
+    if not ts:
+        return None
+    if sys.version_info >= (3, 11):
+        # fromisoformat() is much faster than strptime(). Jira provides offsets as "+0100", turn them into "+01:00"
+        if ts[-5] in "+-" and ts[-4:].isdigit():
+            ts = f"{ts[:-2]}:{ts[-2:]}"
+        # milliseconds are discarded, as done by the strptime() format below
+        return datetime.datetime.fromisoformat(ts).replace(microsecond=0)
     # https://docs.python.org/3/library/re.html#re.sub
-    return datetime.datetime.strptime(re.sub("\.\d\d\d",".000", ts, 1), "%Y-%m-%dT%H:%M:%S.000%z") if ts else None
+    return datetime.datetime.strptime(_TS_MSEC_RE.sub(".000", ts, count=1), "%Y-%m-%dT%H:%M:%S.000%z")
 
+@functools.lru_cache(maxsize=1 << 15)
 def jira_timestamp_to_epoch(ts:str) -> float:
     # https://docs.python.org/3/library/re.html#re.sub
     return jira_timestamp_to_dt(ts).timestamp() if ts else None
 
+# conversion is the most expensive step per comment, and bodies repeat (e.g. bot messages), hence results are cached
+@functools.lru_cache(maxsize=8192)
+def jira_markup_to_md(text:str) -> str:
+    return convert_to_md(text) if text else text
+
+class JitteredRetry(urllib3.util.Retry):
+    """Retry policy adding a random jitter to the exponential backoff, so that concurrent workers do not retry in lockstep."""
+    def get_backoff_time(self) -> float:
+        backoff = super().get_backoff_time()
+        # urllib3 2.x provides a per-instance backoff_max, older versions only the class constant
+        backoff_max = getattr(self, "backoff_max", self.DEFAULT_BACKOFF_MAX)
+        return min(backoff_max, backoff + random.uniform(0, backoff)) if backoff else backoff
+
 # this function call jira and tries to connect with it
-def get_jira_connection(server:str, token:str, client_TLS_cert:str=None, client_TLS_key:str=None, logger:logging.Logger=None) -> jira.client.JIRA:
+def get_jira_connection(server:str, token:str, client_TLS_cert:str=None, client_TLS_key:str=None, parallelism:int=4, logger:logging.Logger=None) -> jira.client.JIRA:
     if not logger:
         logger = logging.getLogger("jiraconnection")
     # Connects to Jira and returns a Jira object
@@ -59,7 +170,16 @@ def get_jira_connection(server:str, token:str, client_TLS_cert:str=None, client_
         jira_options = {"client_cert": (client_TLS_cert, client_TLS_key)}
     try:
         logger.info(f'Connecting to Jira on "{server}" with token "{token[:4]}..."')
-        j = jira.JIRA(server=server, token_auth=token, options=jira_options)
+        # retries are performed by the HTTP adapter mounted below, not by jira's own session
+        j = jira.JIRA(server=server, token_auth=token, options=jira_options, max_retries=0)
+        # keep enough pooled connections for the concurrent calls and retry transient errors
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=max(16, parallelism),
+            pool_maxsize=max(32, parallelism * 2),
+            max_retries=JitteredRetry(total=5, backoff_factor=2.0, status_forcelist=(429, 500, 502, 503, 504), allowed_methods=frozenset(["GET", "HEAD"]), respect_retry_after_header=True, raise_on_status=False)
+        )
+        j._session.mount("http://", adapter)
+        j._session.mount("https://", adapter)
         logger.info(f'Jira connected as user "{j.session().name}" to "{server}"')
         return j
     except jira.exceptions.JIRAError as e:
@@ -69,41 +189,54 @@ def get_jira_connection(server:str, token:str, client_TLS_cert:str=None, client_
     except FileNotFoundError as e:
         raise JiraRelatedError(f"Jira connection '{server}' failed: FileNotFoundError. Certificate files not found. {e}") from e
 
-def get_jira_issues(jira_client: jira.client.JIRA, jql: str, fields: list = None, expand=None, batch_size: int = 100):
+def get_jira_issues(jira_client: jira.client.JIRA, jql: str, fields: list = None, expand=None, batch_size: int = 500, parallelism: int = 4, logger:logging.Logger=None):
     """ iterator which collects the issues from jira using the provided jira_client and jql query, and 'yields' them one by one"""
     if not isinstance(jira_client, jira.client.JIRA):
         raise ValueError("get_jira_issues: Invalid jira client")
     elif jql in (None, ""):
         raise ValueError("get_jira_issues: Invalid JQL")
+    if not logger:
+        logger = logging.getLogger("jiraissues")
     
-    def _robust_search_issues(jira_client: jira.client.JIRA, jql: str, fields: list = None, expand=None, max_results:int=100, start_at:int = None, retries:int=5, wait_between_retries_s:int=60):
-        performed_calls = 0
-        while performed_calls < retries:
-            performed_calls+=1
-            try:
-                return jira_client.search_issues(jql, fields=fields, expand=expand, maxResults=max_results, startAt=start_at)
-            except jira.exceptions.JIRAError as e:
-                # 500 - internal server error
-                # 503 - service unavailable
-                if e.status_code in (500, 503) and performed_calls < retries:
-                    # wait and decrease
-                    time.sleep(performed_calls * wait_between_retries_s)
-                else:
-                    raise e
+    def _robust_search_issues(jira_client: jira.client.JIRA, jql: str, fields: list = None, expand=None, max_results:int=100, start_at:int = None):
+        # transient errors (429, 500, 502, 503, 504) are retried by the HTTP adapter mounted in get_jira_connection()
+        return jira_client.search_issues(jql, fields=fields, expand=expand, maxResults=max_results, startAt=start_at)
     try:
         start_at = 0
         tot_results = None
         issue = None
-        while tot_results == None or start_at < tot_results:
-            # Search returns first 50 results, `maxResults` must be set to exceed this
-            # https://jira.readthedocs.io/en/master/api.html#jira.JIRA.search_issues
-            # response = jira_client.search_issues(jql, fields=fields, expand=expand, maxResults=batch_size, startAt=start_at)
-            response = _robust_search_issues(jira_client, jql, fields=fields, expand=expand, max_results=batch_size, start_at=start_at, retries=5, wait_between_retries_s=45)
-            # total # of issues the jql returns
-            tot_results = response.total
-            start_at += len(response)
-            for issue in response.iterable:
-                yield issue
+        # Search returns first 50 results, `maxResults` must be set to exceed this
+        # https://jira.readthedocs.io/en/master/api.html#jira.JIRA.search_issues
+        # phase 1: the first page provides the total number of issues returned by the jql
+        response = _robust_search_issues(jira_client, jql, fields=fields, expand=expand, max_results=batch_size, start_at=start_at)
+        tot_results = response.total
+        if len(response) < batch_size and len(response) < tot_results:
+            # the server caps maxResults (jira.search.views.default.max): adopt its limit for the subsequent calls
+            logger.warning(f"get_jira_issues: requested batch_size={batch_size} but server returned {len(response)} issues per page. Using batch_size={len(response)}")
+            batch_size = len(response)
+        for issue in response.iterable:
+            yield issue
+        if len(response) == 0:
+            return
+        # phase 2: the remaining pages are independent from each other and are retrieved concurrently.
+        # Pages are yielded in order, keeping at most 2*parallelism of them in flight
+        offsets = iter(range(len(response), tot_results, batch_size))
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, parallelism), thread_name_prefix="jirasearch")
+        try:
+            def _submit(offset:int):
+                return (offset, executor.submit(_robust_search_issues, jira_client, jql, fields=fields, expand=expand, max_results=batch_size, start_at=offset))
+            pending = collections.deque(_submit(offset) for offset in itertools.islice(offsets, 2 * max(1, parallelism)))
+            while pending:
+                start_at, future = pending.popleft()
+                response = future.result()
+                next_offset = next(offsets, None)
+                if next_offset is not None:
+                    pending.append(_submit(next_offset))
+                for issue in response.iterable:
+                    yield issue
+        finally:
+            # when the iteration is abandoned (error, interruption), do not wait for the pages still queued
+            executor.shutdown(wait=False, cancel_futures=True)
     except jira.exceptions.JIRAError as e:
         raise JiraRelatedError(f"get_jira_issues: JQL query ERROR when executing search_issues() function - jql='{jql}', tot_results={tot_results}, start_at={start_at}, last_returned_issue={issue} - {e.text}", status_code=e.status_code) from e
 
@@ -10,18 +10,30 @@ import sys
 import json
 import time
 import argparse
+import operator
+import itertools
+import collections
+import concurrent.futures
 import datetime
 import logging
 import functools
 from typing import Any, Dict, List, Tuple
 from configparser import ConfigParser, NoOptionError, BasicInterpolation
 
-# these 2 modules need to be installed with pip
+# this module needs to be installed with pip
 import jira
 import custom_lib
-from jira2markdown import convert as convert_to_md
+try:
+    # optional: orjson serializes considerably faster than the json module
+    from orjson import dumps as _dumps
+except ImportError:
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj).encode("utf-8")
 
 CHECKPOINT_TIME_FORMAT="%Y-%m-%dT%H:%M:%S%z"
+# the only issue fields used to generate the output: requesting just these keeps the search responses small.
+# "comment" provides the comments inline, no expansion (e.g. renderedFields) is needed
+ISSUE_FIELDS=["summary", "issuetype", "priority", "reporter", "assignee", "created", "comment"]
 #######################################################################
 
 
@@ -30,33 +42,87 @@ logger = logging.getLogger("jirasync")
 logger.setLevel(logging.INFO)
 
 
-JIRA_USER_REF_REGEX = re.compile("\[~([^\]]+)\]")
+JIRA_USER_REF_REGEX = re.compile(r"\[~([^\]]+)\]")
 
-def get_user_references_from_comment(jira_ref, comment:str, references_cache: dict) -> list:
-    # provides a list of jira user objects referenced within the comment's body
+def get_user_references_from_comment(jira_ref, comment:str, references_cache: dict, projection=lambda ju: ju) -> list:
+    # provides a list of the users referenced within the comment's body, as {"emailAddress": ...} dictionaries
+    # transformed through projection (e.g. to keep the email address only)
+    # references_cache maps usernames to those dictionaries, or to custom_lib.UserNotFound for users which are not found in Jira
     if references_cache is None:
         references_cache = {}
     
     referenced_jira_users = []
-    # used to avoid duplicating data within the references list
-    already_added_users = set()
-    # search all user references within the comment...
-    for u in re.findall(JIRA_USER_REF_REGEX, comment):
-        # ...and keep only those which have not yet been added to the final list (in case some are duplicates)
-        if u not in already_added_users:
-            try:
-                referenced_jira_users.append(references_cache[u])
-            except KeyError:
-                try: 
-                    ju = jira_ref.user(u)
-                    references_cache[u] = ju
-                    referenced_jira_users.append(ju)
-                except: 
-                    logger.warning(f"User '{u}' not found in Jira")
-        already_added_users.add(u)
+    # search all user references within the comment, keeping each user only once (in order of appearance)
+    for u in dict.fromkeys(JIRA_USER_REF_REGEX.findall(comment)):
+        try:
+            cached = references_cache[u]
+        except KeyError:
+            try: 
+                ju = jira_ref.user(u)
+                cached = {"emailAddress": ju.emailAddress}
+            except jira.exceptions.JIRAError as e:
+                if e.status_code != 404:
+                    # not cached: the user will be requested again
+                    logger.warning(f"Unable to retrieve user '{u}' from Jira: {e.status_code} {e.text}")
+                    continue
+                logger.warning(f"User '{u}' not found in Jira")
+                cached = custom_lib.UserNotFound(time.time())
+            references_cache[u] = cached
+        if not isinstance(cached, custom_lib.UserNotFound):
+            referenced_jira_users.append(projection(cached))
     return referenced_jira_users
 
-def process(source_jira, JQL):
+def process_issue(source_jira, issue, user_references_cache: dict) -> bytes:
+    # provides the ndjson lines (one per comment) generated for the issue
+    # local names avoid the module attribute lookups within the loop
+    _j2e = custom_lib.jira_timestamp_to_epoch
+    _convert = custom_lib.jira_markup_to_md
+    _email = operator.itemgetter("emailAddress")
+    prev_created = None
+    comment_seq = 0
+    # comments are provided within the search results: retrieve them separately only if the list was truncated
+    comments = issue.fields.comment.comments
+    if issue.fields.comment.total > len(comments):
+        comments = source_jira.comments(issue)
+    if not comments:
+        return b""
+    # ticket data is the same for all comments of the issue
+    ticket_dict = {
+        "key": issue.key,
+        "title": issue.fields.summary,
+        "issuetype": issue.fields.issuetype.name,
+        "reporter": issue.fields.reporter.name,
+        "assignee": issue.fields.assignee.name if issue.fields.assignee else None,
+        "priority": issue.fields.priority.name,
+        "created": issue.fields.created,
+        "created_epoch": _j2e(issue.fields.created),
+    }
+    lines = []
+    for comment in comments:
+        c = {
+            "ticket": ticket_dict,
+            "comment": _convert(comment.body),
+            "author": comment.author.displayName,
+            "author_email": comment.author.emailAddress,
+            "seq": comment_seq,
+            "created": comment.created,
+            "updated": comment.updated,
+            "created_epoch": _j2e(comment.created),
+            "updated_epoch": _j2e(comment.updated),
+            "referenced_users": get_user_references_from_comment(source_jira, comment.body, user_references_cache, projection=_email),
+        }
+        
+        comment_created_dt = custom_lib.jira_timestamp_to_dt(comment.created)
+        if not prev_created is None: 
+            c["delta_created_h"] = round((comment_created_dt - prev_created).total_seconds()/3600.0, 1)
+        prev_created = comment_created_dt
+        comment_seq+=1
+        lines.append(_dumps(c))
+    lines.append(b"")
+    logger.debug(f"    Issue {issue.key} has {comment_seq} comments")
+    return b"\n".join(lines)
+
+def process(source_jira, JQL, batch_size=500, parallelism=4, user_references_cache=None):
     try:
         # log a monitoring event
         _new_checkpoint = None
@@ -66,44 +132,33 @@ def process(source_jira, JQL):
         # latest_update_retrieved is used to track which is the latest updated ts of the issues returned by the JQL. 
         # It will in the end be the new checkpoint stored within the configuration file
         logger.info(f"Searching for issues on source jira instance through JQL:\n\t{JQL}")
-        user_references_cache = {}
+        if user_references_cache is None:
+            user_references_cache = {}
         i = 0
-        for issue in custom_lib.get_jira_issues(source_jira, JQL, fields=["summary", "issuetype", "priority", "reporter", "assignee", "created"], expand=None, batch_size=100):
-            i+=1
-            logger.info(f"Processing issue {i}: {issue.key}")
-            prev_created = None
-            comment_seq = 0
-            c_cnt = 0
-            for comment in source_jira.comments(issue):
-                c = dict(
-                    ticket = dict(
-                        key = issue.key,
-                        title = issue.fields.summary,
-                        issuetype = issue.fields.issuetype.name,
-                        reporter = issue.fields.reporter.name,
-                        assignee = issue.fields.assignee.name if issue.fields.assignee else None,
-                        priority = issue.fields.priority.name,
-                        created = issue.fields.created,
-                        created_epoch = custom_lib.jira_timestamp_to_epoch(issue.fields.created)
-                    ),
-                    comment = convert_to_md(comment.body),
-                    author = comment.author.displayName,
-                    author_email = comment.author.emailAddress,
-                    seq = comment_seq, 
-                    created = comment.created,
-                    updated = comment.updated,
-                    created_epoch = custom_lib.jira_timestamp_to_epoch(comment.created),
-                    updated_epoch = custom_lib.jira_timestamp_to_epoch(comment.updated),
-                    referenced_users = [ju.emailAddress for ju in get_user_references_from_comment(source_jira, comment.body, user_references_cache)]
-                )
-                
-                comment_created_dt = custom_lib.jira_timestamp_to_dt(comment.created)
-                if not prev_created is None: 
-                    c["delta_created_h"] = round((comment_created_dt - prev_created).total_seconds()/3600.0, 1)
-                prev_created = comment_created_dt
-                comment_seq+=1
-                print(json.dumps(c, sort_keys=True))
-            logger.debug(f"    Issue {i} {issue.key} has {c_cnt} comments")
+        out = sys.stdout.buffer
+        issues = custom_lib.get_jira_issues(source_jira, JQL, fields=ISSUE_FIELDS, expand=None, batch_size=batch_size, parallelism=parallelism, logger=logger)
+        # issues are processed concurrently, while their output is written in the order provided by the JQL.
+        # At most 2*parallelism issues are in flight
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, parallelism), thread_name_prefix="jiraissue")
+        try:
+            def _submit(issue):
+                nonlocal i
+                i+=1
+                logger.info(f"Processing issue {i}: {issue.key}")
+                return executor.submit(process_issue, source_jira, issue, user_references_cache)
+            pending = collections.deque(_submit(issue) for issue in itertools.islice(issues, 2 * max(1, parallelism)))
+            while pending:
+                payload = pending.popleft().result()
+                issue = next(issues, None)
+                if issue is not None:
+                    pending.append(_submit(issue))
+                if payload:
+                    out.write(payload)
+                    out.flush()
+        finally:
+            # on errors or interruptions, do not wait for the issues still queued and stop the search right away
+            executor.shutdown(wait=False, cancel_futures=True)
+            issues.close()
     except KeyboardInterrupt as e:
         raise e
     except Exception as e:
@@ -123,6 +178,8 @@ if __name__ == "__main__":
     # Set through a configuration in the config file
     latest_update_retrieved = None
     JQL = None
+    USER_CACHE_FILE = None
+    user_references_cache = None
     try:
         if not os.path.isfile(args.config_file):
             logger.error(f"Configuration file '{args.config_file}' not found.")
@@ -137,16 +194,23 @@ if __name__ == "__main__":
             logger.error(f'Missing stanza "{args.stanza}" in file "{args.config_file}"')
             raise ValueError(f"Invalid source stanza '{args.stanza}' specified for config file '{args.config_file}'")
         
+        # interpolation can be disabled, e.g. when values legitimately contain "$" or "%" characters
+        if configs.get(args.stanza, "interpolation", raw=True, fallback="env").strip().lower() == "none":
+            configs=ConfigParser(interpolation=None)
+            configs.read(args.config_file)
+        
         try:
             # connectivity to SOURCE jira
-            config_options = configs.options(args.stanza)
             SOURCE_JIRA_SERVER=configs.get(args.stanza,"jira_server")
             SOURCE_JIRA_TOKEN=configs.get(args.stanza,"jira_token")
-            SOURCE_CLIENT_CRT=configs.get(args.stanza,'client_crt') if "client_crt" in config_options else None
-            SOURCE_CLIENT_KEY=configs.get(args.stanza,'client_key') if "client_key" in config_options else None
+            SOURCE_CLIENT_CRT=configs.get(args.stanza,'client_crt', fallback=None)
+            SOURCE_CLIENT_KEY=configs.get(args.stanza,'client_key', fallback=None)
             JQL=configs.get(args.stanza,'jql')
+            BATCH_SIZE=configs.getint(args.stanza,'batch_size', fallback=500)
+            PARALLELISM=configs.getint(args.stanza,'parallelism', fallback=4)
+            USER_CACHE_FILE=configs.get(args.stanza,'user_cache_file', fallback=None)
        
-            source_jira = custom_lib.get_jira_connection(server=SOURCE_JIRA_SERVER, token=SOURCE_JIRA_TOKEN, client_TLS_cert=SOURCE_CLIENT_CRT, client_TLS_key=SOURCE_CLIENT_KEY, logger=logger)
+            source_jira = custom_lib.get_jira_connection(server=SOURCE_JIRA_SERVER, token=SOURCE_JIRA_TOKEN, client_TLS_cert=SOURCE_CLIENT_CRT, client_TLS_key=SOURCE_CLIENT_KEY, parallelism=PARALLELISM, logger=logger)
         except NoOptionError as e:
             msg = f"Missing configuration in stanza {args.stanza} of file {args.config_file}: {e}"
             logger.error(msg)
@@ -164,7 +228,11 @@ if __name__ == "__main__":
             logger.exception(msg)
             raise Exception(msg) from e 
     
-        process(source_jira, JQL)
+        if USER_CACHE_FILE:
+            user_references_cache = custom_lib.load_user_cache(USER_CACHE_FILE, SOURCE_JIRA_SERVER, logger=logger)
+        else:
+            user_references_cache = {}
+        process(source_jira, JQL, batch_size=BATCH_SIZE, parallelism=PARALLELISM, user_references_cache=user_references_cache)
 
     except KeyboardInterrupt:
         logger.info("Interrupted")
@@ -173,5 +241,7 @@ if __name__ == "__main__":
     else:
         logger.info("Execution successful")
     finally:
+        if USER_CACHE_FILE and user_references_cache is not None:
+            custom_lib.save_user_cache(USER_CACHE_FILE, SOURCE_JIRA_SERVER, user_references_cache, logger=logger)
         logger.info(f"Executed JQL: {JQL}")
         logger.info("Exiting")